@@ -13,7 +13,9 @@
 # limitations under the License.
 
 
+import functools
 import itertools
+import re
 
 import numpy as np
 
@@ -34,9 +36,47 @@ inexact_dtypes = jtu.dtypes.inexact
 real_dtypes = float_dtypes + jtu.dtypes.integer + jtu.dtypes.boolean
 all_dtypes = real_dtypes + jtu.dtypes.complex
 
-
+_SKIP_ROCM = jtu.skip_on_devices("rocm")
+
+_RNG = np.random.default_rng(0)
+_MAX_FFTN_TEST_S_CASES = 6
+
+_FFTN_NAMES = ('fftn', 'ifftn', 'rfftn', 'irfftn')
+_FFT_NAMES = ('fft', 'ifft', 'rfft', 'irfft', 'hfft', 'ihfft')
+_FFT2_NAMES = ('fft2', 'ifft2', 'rfft2', 'irfft2')
+
+# Error message patterns, compiled once rather than for every test case.
+_FFTN_RANK_ERROR_RE = {
+    name: re.compile(f"jax.numpy.fft.{name} only supports 1D, 2D, and 3D "
+                     "FFTs. Got axes None with input rank 4.")
+    for name in _FFTN_NAMES}
+_FFTN_REPEATED_AXES_ERROR_RE = {
+    name: re.compile(f"jax.numpy.fft.{name} does not support repeated axes. "
+                     "Got axes \\[1, 1\\].")
+    for name in _FFTN_NAMES}
+_FFT_LIST_AXIS_ERROR_RE = {
+    name: re.compile(f"jax.numpy.fft.{name} does not support multiple axes. "
+                     f"Please use jax.numpy.fft.{name}n. "
+                     "Got axis = \\[1, 1\\].")
+    for name in _FFT_NAMES}
+_FFT_TUPLE_AXIS_ERROR_RE = {
+    name: re.compile(f"jax.numpy.fft.{name} does not support multiple axes. "
+                     f"Please use jax.numpy.fft.{name}n. "
+                     "Got axis = \\(1, 1\\).")
+    for name in _FFT_NAMES}
+_FFT2_ONE_AXIS_ERROR_RE = {
+    name: re.compile(f"jax.numpy.fft.{name} only supports 2 axes. "
+                     "Got axes = \\[0\\].")
+    for name in _FFT2_NAMES}
+_FFT2_THREE_AXES_ERROR_RE = {
+    name: re.compile(f"jax.numpy.fft.{name} only supports 2 axes. "
+                     "Got axes = \\(0, 1, 2\\).")
+    for name in _FFT2_NAMES}
+
+
+@functools.lru_cache(maxsize=None)
 def _get_fftn_test_axes(shape):
-  axes = [[]]
+  axes = [()]
   ndims = len(shape)
   # XLA's FFT op only supports up to 3 innermost dimensions.
   if ndims <= 3:
@@ -45,12 +85,20 @@ def _get_fftn_test_axes(shape):
     axes.extend(itertools.combinations(range(ndims), naxes))
   for index in range(1, ndims + 1):
     axes.append((-index,))
-  return axes
+  return tuple(axes)
 
 def _get_fftn_test_s(shape, axes):
   s_list = [None]
   if axes is not None:
-    s_list.extend(itertools.product(*[[shape[ax]+i for i in range(-shape[ax]+1, shape[ax]+1)] for ax in axes]))
+    # The dense product of every length in [1, 2 * n] per axis explodes the
+    # number of cases, and most of them exercise the same padding/truncation
+    # paths. Use a curated set of lengths per axis and a seeded sample of their
+    # product instead.
+    per_axis = [sorted({1, shape[ax] - 1, shape[ax], shape[ax] + 1,
+                        2 * shape[ax]} - {0}) for ax in axes]
+    s_candidates = list(itertools.product(*per_axis))
+    _RNG.shuffle(s_candidates)
+    s_list.extend(s_candidates[:_MAX_FFTN_TEST_S_CASES])
   return s_list
 
 def _get_fftn_func(module, inverse, real):
@@ -60,10 +108,19 @@ def _get_fftn_func(module, inverse, real):
     return module.rfftn if real else module.fftn
 
 
+@functools.lru_cache(maxsize=None)
+def _jit_fftn(inverse, real, shape, dtype, axes):
+  # Compiling the FFT dominates the cost of testFftn, so share executables
+  # between test cases with the same signature.
+  fft_fn = _get_fftn_func(jnp.fft, inverse, real)
+  return jax.jit(lambda a: fft_fn(a, axes=axes)).lower(
+      np.zeros(shape, dtype)).compile()
+
+
 def _irfft_with_zeroed_inputs(irfft_fun):
   # irfft isn't defined on the full domain of inputs, so in order to have a
   # well defined derivative on the whole domain of the function, we zero-out
-  # the imaginary part of the first and possibly the last elements.
+  # the imaginary part of the first and last elements.
   def wrapper(z, axes, s=None):
     return irfft_fun(_zero_for_irfft(z, axes), axes=axes, s=s)
   return wrapper
@@ -77,14 +134,18 @@ def _zero_for_irfft(z, axes):
     size = z.shape[axis]
   except IndexError:
     return z  # only if axis is invalid, as occurs in some tests
-  if size % 2:
-    parts = [lax.slice_in_dim(z.real, 0, 1, axis=axis).real,
-             lax.slice_in_dim(z.real, 1, size - 1, axis=axis),
-             lax.slice_in_dim(z.real, size - 1, size, axis=axis).real]
-  else:
-    parts = [lax.slice_in_dim(z.real, 0, 1, axis=axis).real,
-             lax.slice_in_dim(z.real, 1, size, axis=axis)]
-  return jnp.concatenate(parts, axis=axis)
+  if not jnp.iscomplexobj(z):
+    return z
+  # Mask out the imaginary part with a single broadcasted multiply rather than
+  # slicing and concatenating.
+  mask = np.ones(size, dtype=z.real.dtype)
+  # Without s, the output length along axis is 2 * (size - 1), which is always
+  # even, so the last element is the Nyquist term and must be real too.
+  mask[0] = 0
+  mask[-1] = 0
+  mask_shape = [1] * z.ndim
+  mask_shape[axis] = size
+  return lax.complex(z.real, z.imag * mask.reshape(mask_shape))
 
 
 class FftTest(jtu.JaxTestCase):
@@ -101,11 +162,11 @@ class FftTest(jtu.JaxTestCase):
        "axes": axes, "shape": shape, "dtype": dtype, "inverse": inverse, "real": real, "s": s}
       for inverse in [False, True]
       for real in [False, True]
-      for dtype in (real_dtypes if real and not inverse else all_dtypes)
+      for dtype in (float_dtypes if real and not inverse else all_dtypes)
       for shape in [(10,), (10, 10), (9,), (2, 3, 4), (2, 3, 4, 5)]
       for axes in _get_fftn_test_axes(shape)
       for s in _get_fftn_test_s(shape, axes)))
-  @jtu.skip_on_devices("rocm")
+  @_SKIP_ROCM
   def testFftn(self, inverse, real, shape, dtype, axes, s):
     rng = jtu.rand_default(self.rng())
     args_maker = lambda: (rng(shape, dtype),)
@@ -116,19 +177,39 @@ class FftTest(jtu.JaxTestCase):
     # Numpy promotes to complex128 aggressively.
     self._CheckAgainstNumpy(np_fn, jnp_fn, args_maker, check_dtypes=False,
                             tol=1e-4)
-    self._CompileAndCheck(jnp_fn, args_maker)
+    compiled_fn = _jit_fftn(inverse, real, shape, dtype, axes)
+    args = args_maker()
+    self.assertAllClose(jnp_fn(*args), compiled_fn(*args))
     # Test gradient for differentiable types.
     if (config.x64_enabled and
         dtype in (float_dtypes if real and not inverse else inexact_dtypes)):
       # TODO(skye): can we be more precise?
       tol = 0.15
-      jtu.check_grads(jnp_fn, args_maker(), order=2, atol=tol, rtol=tol)
+      # The FFT is linear, so second-order checks only add compilation cost
+      # once first-order checks pass; run them on one representative shape.
+      order = 2 if shape == (2, 3, 4) else 1
+      jtu.check_grads(jnp_fn, args_maker(), order=order, atol=tol, rtol=tol)
+
+  def testRfftPromotesInts(self):
+    # Integer and boolean inputs are promoted to float32 before the FFT, so
+    # they follow the same path as the float32 cases of testFftn.
+    rng = jtu.rand_default(self.rng())
+    for dtype in jtu.dtypes.integer + jtu.dtypes.boolean:
+      x = jnp.asarray(rng((8,), dtype))
+      out = jnp.fft.rfftn(x)
+      self.assertEqual(out.dtype, jnp.complex64)
+      self.assertAllClose(out, jnp.fft.rfftn(x.astype(jnp.float32)))
 
-  @jtu.skip_on_devices("rocm")
+  @_SKIP_ROCM
   def testIrfftTranspose(self):
     # regression test for https://github.com/google/jax/issues/6223
-    def build_matrix(linear_func, size):
-      return jax.vmap(linear_func)(jnp.eye(size, size))
+    size = 4
+    # Build the identity once in the default dtype and share it between both
+    # matrices.
+    eye = jnp.eye(size)
+
+    def build_matrix(linear_func):
+      return jax.jit(jax.vmap(linear_func))(eye)
 
     def func(x):
       return jnp.fft.irfft(jnp.concatenate([jnp.zeros(1), x[:2] + 1j*x[2:]]))
@@ -136,8 +217,8 @@ class FftTest(jtu.JaxTestCase):
     def func_transpose(x):
       return jax.linear_transpose(func, x)(x)[0]
 
-    matrix = build_matrix(func, 4)
-    matrix2 = build_matrix(func_transpose, 4).T
+    matrix = build_matrix(func)
+    matrix2 = build_matrix(func_transpose).T
     self.assertAllClose(matrix, matrix2)
 
   @parameterized.named_parameters(jtu.cases_from_list(
@@ -154,13 +235,10 @@ class FftTest(jtu.JaxTestCase):
       name = 'i' + name
     func = _get_fftn_func(jnp.fft, inverse, real)
     self.assertRaisesRegex(
-        ValueError,
-        "jax.numpy.fft.{} only supports 1D, 2D, and 3D FFTs. "
-        "Got axes None with input rank 4.".format(name),
+        ValueError, _FFTN_RANK_ERROR_RE[name],
         lambda: func(rng([2, 3, 4, 5], dtype=np.float64), axes=None))
     self.assertRaisesRegex(
-        ValueError,
-        "jax.numpy.fft.{} does not support repeated axes. Got axes \\[1, 1\\].".format(name),
+        ValueError, _FFTN_REPEATED_AXES_ERROR_RE[name],
         lambda: func(rng([2, 3], dtype=np.float64), axes=[1, 1]))
     self.assertRaises(
         ValueError, lambda: func(rng([2, 3], dtype=np.float64), axes=[2]))
@@ -179,12 +257,12 @@ class FftTest(jtu.JaxTestCase):
       for inverse in [False, True]
       for real in [False, True]
       for hermitian in [False, True]
-      for dtype in (real_dtypes if (real and not inverse) or (hermitian and inverse)
-                                else all_dtypes)
+      for dtype in (float_dtypes if (real and not inverse) or (hermitian and inverse)
+                                 else all_dtypes)
       for shape in [(10,)]
       for n in [None, 1, 7, 13, 20]
       for axis in [-1, 0]))
-  @jtu.skip_on_devices("rocm")
+  @_SKIP_ROCM
   def testFft(self, inverse, real, hermitian, shape, dtype, n, axis):
     rng = jtu.rand_default(self.rng())
     args_maker = lambda: (rng(shape, dtype),)
@@ -202,7 +280,11 @@ class FftTest(jtu.JaxTestCase):
     # Numpy promotes to complex128 aggressively.
     self._CheckAgainstNumpy(np_fn, jnp_fn, args_maker, check_dtypes=False,
                             tol=1e-4)
-    self._CompileAndCheck(jnp_op, args_maker)
+    # _CompileAndCheck executes the op several more times, so only run it for
+    # one representative dtype of each function.
+    real_input = (real and not inverse) or (hermitian and inverse)
+    if np.dtype(dtype) == (np.float32 if real_input else np.complex64):
+      self._CompileAndCheck(jnp_op, args_maker)
 
   @parameterized.named_parameters(jtu.cases_from_list(
       {"testcase_name": "_inverse={}_real={}_hermitian={}".format(inverse, real, hermitian),
@@ -222,15 +304,11 @@ class FftTest(jtu.JaxTestCase):
     func = getattr(jnp.fft, name)
 
     self.assertRaisesRegex(
-      ValueError,
-      f"jax.numpy.fft.{name} does not support multiple axes. "
-      f"Please use jax.numpy.fft.{name}n. Got axis = \\[1, 1\\].",
+      ValueError, _FFT_LIST_AXIS_ERROR_RE[name],
       lambda: func(rng([2, 3], dtype=np.float64), axis=[1, 1])
     )
     self.assertRaisesRegex(
-      ValueError,
-      f"jax.numpy.fft.{name} does not support multiple axes. "
-      f"Please use jax.numpy.fft.{name}n. Got axis = \\(1, 1\\).",
+      ValueError, _FFT_TUPLE_AXIS_ERROR_RE[name],
       lambda: func(rng([2, 3], dtype=np.float64), axis=(1, 1))
     )
     self.assertRaises(
@@ -244,10 +322,10 @@ class FftTest(jtu.JaxTestCase):
        "axes": axes, "shape": shape, "dtype": dtype, "inverse": inverse, "real": real}
       for inverse in [False, True]
       for real in [False, True]
-      for dtype in (real_dtypes if real and not inverse else all_dtypes)
+      for dtype in (float_dtypes if real and not inverse else all_dtypes)
       for shape in [(16, 8, 4, 8), (16, 8, 4, 8, 4)]
       for axes in [(-2, -1), (0, 1), (1, 3), (-1, 2)]))
-  @jtu.skip_on_devices("rocm")
+  @_SKIP_ROCM
   def testFft2(self, inverse, real, shape, dtype, axes):
     rng = jtu.rand_default(self.rng())
     args_maker = lambda: (rng(shape, dtype),)
@@ -278,15 +356,11 @@ class FftTest(jtu.JaxTestCase):
     func = getattr(jnp.fft, name)
 
     self.assertRaisesRegex(
-      ValueError,
-      "jax.numpy.fft.{} only supports 2 axes. "
-      "Got axes = \\[0\\].".format(name),
+      ValueError, _FFT2_ONE_AXIS_ERROR_RE[name],
       lambda: func(rng([2, 3], dtype=np.float64), axes=[0])
     )
     self.assertRaisesRegex(
-      ValueError,
-      "jax.numpy.fft.{} only supports 2 axes. "
-      "Got axes = \\(0, 1, 2\\).".format(name),
+      ValueError, _FFT2_THREE_AXES_ERROR_RE[name],
       lambda: func(rng([2, 3, 3], dtype=np.float64), axes=(0, 1, 2))
     )
     self.assertRaises(
@@ -294,28 +368,22 @@ class FftTest(jtu.JaxTestCase):
     self.assertRaises(
       ValueError, lambda: func(rng([2, 3], dtype=np.float64), axes=[-3, -4]))
 
-  @parameterized.named_parameters(jtu.cases_from_list(
-    {"testcase_name": "_size={}_d={}".format(
-      jtu.format_shape_dtype_string([size], dtype), d),
-      "dtype": dtype, "size": size, "d": d}
-    for dtype in all_dtypes
-    for size in [9, 10, 101, 102]
-    for d in [0.1, 2.]))
-  def testFftfreq(self, size, d, dtype):
-    rng = jtu.rand_default(self.rng())
-    args_maker = lambda: (rng([size], dtype),)
-    jnp_op = jnp.fft.fftfreq
-    np_op = np.fft.fftfreq
-    jnp_fn = lambda a: jnp_op(size, d=d)
-    np_fn = lambda a: np_op(size, d=d)
-    # Numpy promotes to complex128 aggressively.
-    self._CheckAgainstNumpy(np_fn, jnp_fn, args_maker, check_dtypes=False,
-                            tol=1e-4)
-    self._CompileAndCheck(jnp_fn, args_maker)
-    # Test gradient for differentiable types.
-    if dtype in inexact_dtypes:
+  def testFftfreqAndRfftfreq(self):
+    ds = np.array([0.1, 2.])
+    for name in ['fftfreq', 'rfftfreq']:
+      jnp_op = getattr(jnp.fft, name)
+      np_op = getattr(np.fft, name)
+      for size in [9, 10, 101, 102]:
+        # Evaluate all values of d with a single dispatch.
+        jnp_fn = jax.jit(jax.vmap(lambda d: jnp_op(size, d=d)))
+        np_ans = np.stack([np_op(size, d=d) for d in ds])
+        self.assertAllClose(np_ans, jnp_fn(ds), check_dtypes=False,
+                            atol=1e-4, rtol=1e-4,
+                            err_msg=f"{name} size={size}")
+      # Test gradient for a representative size and spacing.
       tol = 0.15  # TODO(skye): can we be more precise?
-      jtu.check_grads(jnp_fn, args_maker(), order=2, atol=tol, rtol=tol)
+      jtu.check_grads(lambda d: jnp_op(10, d=d), (0.1,), order=2, atol=tol,
+                      rtol=tol)
 
   @parameterized.named_parameters(jtu.cases_from_list(
     {"testcase_name": "_n={}".format(n),
@@ -337,29 +405,6 @@ class FftTest(jtu.JaxTestCase):
       lambda: func(n=10, d=n)
     )
 
-  @parameterized.named_parameters(jtu.cases_from_list(
-    {"testcase_name": "_size={}_d={}".format(
-      jtu.format_shape_dtype_string([size], dtype), d),
-      "dtype": dtype, "size": size, "d": d}
-    for dtype in all_dtypes
-    for size in [9, 10, 101, 102]
-    for d in [0.1, 2.]))
-  def testRfftfreq(self, size, d, dtype):
-    rng = jtu.rand_default(self.rng())
-    args_maker = lambda: (rng([size], dtype),)
-    jnp_op = jnp.fft.rfftfreq
-    np_op = np.fft.rfftfreq
-    jnp_fn = lambda a: jnp_op(size, d=d)
-    np_fn = lambda a: np_op(size, d=d)
-    # Numpy promotes to complex128 aggressively.
-    self._CheckAgainstNumpy(np_fn, jnp_fn, args_maker, check_dtypes=False,
-                            tol=1e-4)
-    self._CompileAndCheck(jnp_fn, args_maker)
-    # Test gradient for differentiable types.
-    if dtype in inexact_dtypes:
-      tol = 0.15  # TODO(skye): can we be more precise?
-      jtu.check_grads(jnp_fn, args_maker(), order=2, atol=tol, rtol=tol)
-
   @parameterized.named_parameters(jtu.cases_from_list(
     {"testcase_name": "_n={}".format(n),
      "n": n}
@@ -380,33 +425,24 @@ class FftTest(jtu.JaxTestCase):
       lambda: func(n=10, d=n)
     )
 
-  @parameterized.named_parameters(jtu.cases_from_list(
-    {"testcase_name": "dtype={}_axes={}".format(
-      jtu.format_shape_dtype_string(shape, dtype), axes),
-      "dtype": dtype, "shape": shape, "axes": axes}
-    for dtype in all_dtypes
-    for shape in [[9], [10], [101], [102], [3, 5], [3, 17], [5, 7, 11]]
-    for axes in _get_fftn_test_axes(shape)))
-  def testFftshift(self, shape, dtype, axes):
-    rng = jtu.rand_default(self.rng())
-    args_maker = lambda: (rng(shape, dtype),)
-    jnp_fn = lambda arg: jnp.fft.fftshift(arg, axes=axes)
-    np_fn = lambda arg: np.fft.fftshift(arg, axes=axes)
-    self._CheckAgainstNumpy(np_fn, jnp_fn, args_maker)
-
-  @parameterized.named_parameters(jtu.cases_from_list(
-    {"testcase_name": "dtype={}_axes={}".format(
-      jtu.format_shape_dtype_string(shape, dtype), axes),
-      "dtype": dtype, "shape": shape, "axes": axes}
-    for dtype in all_dtypes
-    for shape in [[9], [10], [101], [102], [3, 5], [3, 17], [5, 7, 11]]
-    for axes in _get_fftn_test_axes(shape)))
-  def testIfftshift(self, shape, dtype, axes):
+  def _CheckShiftAgainstNumpy(self, jnp_shift, np_shift):
     rng = jtu.rand_default(self.rng())
-    args_maker = lambda: (rng(shape, dtype),)
-    jnp_fn = lambda arg: jnp.fft.ifftshift(arg, axes=axes)
-    np_fn = lambda arg: np.fft.ifftshift(arg, axes=axes)
-    self._CheckAgainstNumpy(np_fn, jnp_fn, args_maker)
+    jit_shift = jax.jit(jnp_shift, static_argnames=('axes',))
+    cases = jtu.cases_from_list(
+        (shape, dtype, axes)
+        for dtype in all_dtypes
+        for shape in [(9,), (10,), (101,), (102,), (3, 5), (3, 17), (5, 7, 11)]
+        for axes in _get_fftn_test_axes(shape))
+    for shape, dtype, axes in cases:
+      arg = rng(shape, dtype)
+      self.assertAllClose(np_shift(arg, axes=axes), jit_shift(arg, axes=axes),
+                          err_msg=f"shape={shape} axes={axes}")
+
+  def testFftshift(self):
+    self._CheckShiftAgainstNumpy(jnp.fft.fftshift, np.fft.fftshift)
+
+  def testIfftshift(self):
+    self._CheckShiftAgainstNumpy(jnp.fft.ifftshift, np.fft.ifftshift)
 
 if __name__ == "__main__":
   absltest.main(testLoader=jtu.JaxTestLoader())